@@ -1,6 +1,20 @@
 #!/usr/bin/env python3
 import sys
+import os
 import re
+import mmap
+from typing import Optional
+
+# Upper bound on the boundary token we are willing to search for.
+_MAX_BOUNDARY_LEN = 256
+
+# Rest of a boundary delimiter line after "--boundary": optional closing "--",
+# optional whitespace, then LF or CRLF. Matched at an offset, never scanned.
+_BOUNDARY_TAIL_RE = re.compile(br'(?P<closing>--)?[ \t]*\r?\n')
+
+# boundary= parameter on a Content-Type value: a properly terminated quoted
+# string, or a bare token.
+_BOUNDARY_PARAM_RE = re.compile(br'boundary=(?:"(?P<quoted>[^"]+)"|(?P<token>[^";\s]+))', re.IGNORECASE)
 
 def die(msg):
     print(f"❌ {msg}")
@@ -8,42 +22,62 @@ def die(msg):
 
 def find_header_block(raw: bytes):
     """
-    Split raw message into (headers_bytes, rest_bytes) at the first blank line.
+    Split raw message at the first blank line.
+    Return (headers_end, body_start, eol) as offsets into raw, so callers can
+    take zero-copy memoryview slices instead of copying the body.
     Detects either CRLF or LF as the separator.
     """
     sep = b"\r\n\r\n"
     idx = raw.find(sep)
     if idx != -1:
-        return raw[:idx], raw[idx+len(sep):], b"\r\n"
+        return idx, idx+len(sep), b"\r\n"
     # fallback to LF
     sep = b"\n\n"
     idx = raw.find(sep)
     if idx == -1:
         die("Could not find end of top-level header block.")
-    return raw[:idx], raw[idx+len(sep):], b"\n"
+    return idx, idx+len(sep), b"\n"
 
-def get_top_level_boundary(top_headers: bytes):
+def _iter_lines(buf: bytes, start: int, end: int):
+    """
+    Yield (line_start, line_end) offsets for each line in buf[start:end],
+    excluding the LF or CRLF terminator. No per-line bytes are allocated.
     """
-    Parse the *raw* top-level headers to get the multipart/signed boundary token.
+    pos = start
+    while pos < end:
+        nl = buf.find(b"\n", pos, end)
+        if nl == -1:
+            yield pos, end
+            return
+        line_end = nl - 1 if nl > pos and buf[nl-1] == 0x0D else nl
+        yield pos, line_end
+        pos = nl + 1
+
+def get_top_level_boundary(raw: bytes, headers_end: int):
+    """
+    Parse the *raw* top-level headers (raw[:headers_end]) to get the
+    multipart/signed boundary token.
     We do not normalize quoting; we only need the token (without quotes)
     to find boundary delimiter lines in the body.
     """
-    # join folded lines for Content-Type parsing (RFC allows folding)
-    # We do minimal unfolding: lines starting with space/tab are continuations.
-    lines = top_headers.splitlines()
-    unfolded = []
-    for line in lines:
-        if unfolded and (line.startswith(b" ") or line.startswith(b"\t")):
-            unfolded[-1] += line
-        else:
-            unfolded.append(line)
-
-    # find Content-Type header (case-insensitive)
+    # Find the Content-Type header (case-insensitive) in a single pass over
+    # line offsets. We do minimal unfolding (RFC allows folding): lines
+    # starting with space/tab are continuations, and only the Content-Type
+    # header's own continuations are joined. Lowercase only the name prefix,
+    # and stop as soon as the header is complete.
     ct = None
-    for l in unfolded:
-        if l.lower().startswith(b"content-type:"):
-            ct = l[len(b"content-type:"):].strip()
+    prefix = b"content-type:"
+    for s, e in _iter_lines(raw, 0, headers_end):
+        if s < e and raw[s] in b" \t":
+            if ct is not None:
+                ct += raw[s:e]
+            continue
+        if ct is not None:
             break
+        if e - s >= len(prefix) and raw[s:s+len(prefix)].lower() == prefix:
+            ct = raw[s+len(prefix):e]
+    if ct is not None:
+        ct = ct.strip()
     if not ct:
         die("Top-level Content-Type header not found.")
 
@@ -52,33 +86,60 @@ def get_top_level_boundary(top_headers: bytes):
         die("Top-level message is not multipart/signed.")
 
     # extract boundary parameter value (quoted or not)
-    m = re.search(br'boundary=(?P<q>")?(?P<val>[^";\s]+)(?P=q)?', ct, flags=re.IGNORECASE)
+    m = _BOUNDARY_PARAM_RE.search(ct)
     if not m:
         die("Could not find boundary parameter on multipart/signed.")
-    boundary_token = m.group('val')  # bytes, no quotes
+    boundary_token = m.group('quoted') or m.group('token')  # bytes, no quotes
+    # RFC 2046 allows at most 70 chars; refuse anything absurd before scanning with it.
+    if len(boundary_token) > _MAX_BOUNDARY_LEN:
+        die(f"Boundary parameter too long ({len(boundary_token)} bytes).")
     return boundary_token
 
-def iter_signed_boundaries(body: bytes, boundary: bytes):
+def iter_signed_boundaries(body: bytes, boundary: bytes, pos: int = 0, end: Optional[int] = None):
     """
-    Yield (start_index, end_index, is_closing) for each boundary delimiter line:
+    Yield (start_index, end_index, is_closing) for each boundary delimiter line
+    starting in body[pos:end]:
       --boundary[OWS]CRLF        (part boundary)
       --boundary--[OWS]CRLF      (closing boundary)
-    We search in multiline mode anchored to start-of-line.
-    """
-    # Allow optional whitespace after delimiter before EOL.
-    # Match either LF or CRLF line endings. Use (?m) for ^ and $ over multiple lines.
-    pattern = re.compile(
-        br'(?m)^(--' + re.escape(boundary) + br'(?P<closing>--)?)[ \t]*\r?\n'
-    )
-    for m in pattern.finditer(body):
-        start = m.start()
-        end   = m.end()
-        is_closing = (m.group('closing') is not None)
-        yield start, end, is_closing
-
-def split_multipart_signed_parts(body: bytes, boundary: bytes):
-    """
-    For a multipart/signed body:
+    A delimiter must start a line, so we scan for the literal b"\n--boundary"
+    with body.find and validate the rest of the line with a few slice
+    comparisons, falling back to _BOUNDARY_TAIL_RE for trailing whitespace.
+    The scan is a C-level find on the mapping (or on bytes when the input
+    could not be mapped); mmap.find skips ahead like bytes.find only on 3.11+.
+    """
+    delim = b"--" + boundary
+    needle = b"\n" + delim
+    if end is None:
+        end = len(body)
+
+    # The body may open directly with a delimiter line (no preamble).
+    if body[pos:pos+len(delim)] == delim:
+        start = pos
+    else:
+        start = body.find(needle, pos, end)
+        if start != -1:
+            start += 1
+    while start != -1:
+        p = start + len(delim)
+        # Fast path for the usual shapes: "--boundary[--]" then LF or CRLF.
+        # Only trailing whitespace (or a non-delimiter) reaches the regex.
+        is_closing = (body[p:p+2] == b"--")
+        q = p + 2 if is_closing else p
+        if body[q:q+1] == b"\n":
+            yield start, q + 1, is_closing
+        elif body[q:q+2] == b"\r\n":
+            yield start, q + 2, is_closing
+        else:
+            m = _BOUNDARY_TAIL_RE.match(body, p)
+            if m:
+                yield start, m.end(), (m.group('closing') is not None)
+        start = body.find(needle, start, end)
+        if start != -1:
+            start += 1
+
+def split_multipart_signed_parts(body: bytes, boundary: bytes, pos: int = 0):
+    """
+    For a multipart/signed body starting at body[pos:]:
       preamble, then:
         --boundary CRLF
           <part1 headers + body>
@@ -86,119 +147,171 @@ def split_multipart_signed_parts(body: bytes, boundary: bytes):
           <part2 headers + body>
         --boundary-- CRLF
       epilogue
-    Return (part1_bytes, part2_bytes) each including their own headers+body,
-    but NOT including any boundary delimiter lines.
+    Return ((part1_start, part1_end), (part2_start, part2_end)) as offsets into
+    body, each span covering the part's own headers+body but NOT any boundary
+    delimiter lines.
     """
-    # Find all boundaries
-    bmarks = list(iter_signed_boundaries(body, boundary))
-    if len(bmarks) < 2:
-        die("Did not find enough boundary delimiters inside multipart/signed body.")
-
     # We expect at least:
     #   #0: first part delimiter
     #   #1: second part delimiter
-    #   last: closing delimiter (with --)
+    #   later: closing delimiter (with --)
     # Extract the segments between:
-    #   part1 = [end of bmarks[0] : start of bmarks[1]]
-    #   part2 = [end of bmarks[1] : start of closing]
-    # Find closing index
-    closing_idx = None
-    for i, (_s, _e, is_closing) in enumerate(bmarks):
-        if is_closing:
-            closing_idx = i
-            break
-    if closing_idx is None:
+    #   part1 = [end of #0 : start of #1]
+    #   part2 = [end of #1 : start of closing]
+    # Locate the last closing marker first with a single C-level rfind. This
+    # still reads the whole epilogue (or, with no marker, the whole body)
+    # backwards; what it saves is yielding every non-closing delimiter in
+    # Python before dying on a message that has no closing marker at all.
+    # No delimiter can start past the marker, so it also bounds the scan below.
+    closing_marker = b"\n--" + boundary + b"--"
+    last_closing = body.rfind(closing_marker, pos)
+    if last_closing == -1:
         die("Closing boundary not found (no -- after boundary).")
 
-    if closing_idx < 2:
+    # Pull delimiters lazily and stop at the first closing one, so no
+    # delimiter after it is validated or kept.
+    bmarks = iter_signed_boundaries(body, boundary, pos, last_closing + len(closing_marker))
+    first = next(bmarks, None)
+    second = next(bmarks, None)
+    if second is None:
+        die("Did not find enough boundary delimiters inside multipart/signed body.")
+
+    if first[2] or second[2]:
         die("Not enough parts before the closing boundary (need 2 parts).")
 
-    # Compute slices
-    first_delim_start, first_delim_end, _ = bmarks[0]
-    second_delim_start, second_delim_end, _ = bmarks[1]
-    closing_start, _closing_end, _ = bmarks[closing_idx]
+    closing = next((b for b in bmarks if b[2]), None)
+    if closing is None:
+        die("Closing boundary not found (no -- after boundary).")
+
+    # Compute spans
+    first_delim_start, first_delim_end, _ = first
+    second_delim_start, second_delim_end, _ = second
+    closing_start, _closing_end, _ = closing
 
-    part1 = body[first_delim_end:second_delim_start]
-    part2 = body[second_delim_end:closing_start]
+    part1 = (first_delim_end, second_delim_start)
+    part2 = (second_delim_end, closing_start)
 
     # Trim leading lone CRLF/LF if present (after boundary lines there is normally no blank line,
     # but some generators might add one spuriously). We only trim a single empty line safely.
-    for p_name, p in (("part1", part1), ("part2", part2)):
-        if p.startswith(b"\r\n"):
-            p = p[2:]
-        elif p.startswith(b"\n"):
-            p = p[1:]
-        if p_name == "part1":
-            part1 = p
-        else:
-            part2 = p
+    def skip_blank_line(span):
+        start, end = span
+        if body[start:start+2] == b"\r\n":
+            start += 2
+        elif body[start:start+1] == b"\n":
+            start += 1
+        return start, end
 
-    return part1, part2
+    return skip_blank_line(part1), skip_blank_line(part2)
 
-def strip_headers(part_bytes: bytes):
+def strip_headers(body: bytes, start: int, end: int):
     """
-    Split a MIME part into (headers_bytes, body_bytes) using the first blank line.
-    Return (headers, body). If no blank line, body is empty.
+    Split the MIME part body[start:end] at its first blank line.
+    Return (headers_end, body_start) as offsets into body. If no blank line,
+    assume no headers and return (start, start).
     Preserves the original line endings.
     """
     # Try CRLF first
     sep = b"\r\n\r\n"
-    idx = part_bytes.find(sep)
+    idx = body.find(sep, start, end)
     if idx != -1:
-        return part_bytes[:idx], part_bytes[idx+len(sep):]
+        return idx, idx+len(sep)
     # Then LF
     sep = b"\n\n"
-    idx = part_bytes.find(sep)
+    idx = body.find(sep, start, end)
     if idx == -1:
         # no header/body split, assume no headers
-        return b"", part_bytes
-    return part_bytes[:idx], part_bytes[idx+len(sep):]
+        return start, start
+    return idx, idx+len(sep)
+
+def trim_trailing_newline(body: bytes, start: int, end: int) -> int:
+    """
+    Return end moved back over a single trailing CRLF or LF in body[start:end],
+    so the trimmed span can be sliced once without an extra copy.
+    """
+    if end - start >= 2 and body[end-2:end] == b"\r\n":
+        return end - 2
+    elif end > start and body[end-1:end] == b"\n":
+        return end - 1
+    return end
+
+def write_view(path: str, view: memoryview, in_fd: Optional[int] = None, offset: int = 0):
+    """
+    Write a memoryview to path with an unbuffered file, so the bytes go
+    straight from the mapped input to the kernel. Raw writes may be short,
+    so keep writing until the whole view is out.
+    If view is the region of in_fd starting at offset and os.sendfile is
+    available, let the kernel copy it file-to-file instead; anything
+    sendfile could not copy falls back to writing the view.
+    """
+    with open(path, "wb", buffering=0) as f:
+        if in_fd is not None and hasattr(os, "sendfile"):
+            try:
+                while view:
+                    sent = os.sendfile(f.fileno(), in_fd, offset, len(view))
+                    if sent == 0:
+                        break
+                    offset += sent
+                    view = view[sent:]
+            except OSError:
+                pass
+        while view:
+            view = view[f.write(view):]
 
 def main():
     if len(sys.argv) < 2:
-        print("Usage: python extract_pgp_signature_rawsafe.py <email_file.eml>")
+        print("Usage: python prepareVerification.py <email_file.eml>")
         sys.exit(1)
 
     path = sys.argv[1]
     try:
-        raw = open(path, "rb").read()
+        # The file stays open so its parts can be sendfile()'d to the outputs.
+        inp = open(path, "rb")
     except Exception as e:
         die(f"Failed to read file: {e}")
+    with inp:
+        try:
+            # Map the file instead of reading it: pages are faulted in on demand
+            # and every find/slice below works on the mapping directly.
+            raw = mmap.mmap(inp.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):
+            # Pipes, /dev/stdin and empty files cannot be mapped; read them instead.
+            raw = inp.read()
 
-    # 1) Split top-level headers and body; detect EOL style
-    top_headers, top_body, _eol = find_header_block(raw)
-
-    # 2) Extract top-level multipart/signed boundary token (no normalization)
-    boundary = get_top_level_boundary(top_headers)
+        # All parsing works on offsets into raw; outputs are sliced from one
+        # memoryview so the (possibly multi-MB) parts are never copied.
+        mv = memoryview(raw)
 
-    # 3) Extract the two parts (between boundary delimiters) as raw bytes
-    part1, part2 = split_multipart_signed_parts(top_body, boundary)
+        # 1) Split top-level headers and body; detect EOL style
+        headers_end, body_start, _eol = find_header_block(raw)
 
-    # 4) part1 is the SIGNED ENTITY (headers+body) EXACTLY as sent — save as message.txt
-    # NOTE: No modifications, no reserialization, no added/removed quotes/spaces.
-    # 5) part2 is the signature container; strip its headers so only the ASCII armored block remains.
-    _sig_headers, sig_body = strip_headers(part2)
+        # 2) Extract top-level multipart/signed boundary token (no normalization)
+        boundary = get_top_level_boundary(raw, headers_end)
 
-    # Ensure output
-    import os
-    outdir = "extractedSignatureData"
-    os.makedirs(outdir, exist_ok=True)
+        # 3) Locate the two parts (between boundary delimiters) in the raw bytes
+        (p1_start, p1_end), (p2_start, p2_end) = split_multipart_signed_parts(raw, boundary, body_start)
+        part1 = mv[p1_start:trim_trailing_newline(raw, p1_start, p1_end)]
 
-    def trim_trailing_newline(b: bytes) -> bytes:
-        if b.endswith(b"\r\n"):
-            return b[:-2]
-        elif b.endswith(b"\n"):
-            return b[:-1]
-        return b
+        # 4) part1 is the SIGNED ENTITY (headers+body) EXACTLY as sent — save as message.txt
+        # NOTE: No modifications, no reserialization, no added/removed quotes/spaces.
+        # 5) part2 is the signature container; strip its headers so only the ASCII armored block remains.
+        _sig_headers_end, sig_start = strip_headers(raw, p2_start, p2_end)
+        sig_body = mv[sig_start:trim_trailing_newline(raw, sig_start, p2_end)]
 
-    part1 = trim_trailing_newline(part1)
-    sig_body = trim_trailing_newline(sig_body)
+        # Ensure output
+        outdir = "extractedSignatureData"
+        os.makedirs(outdir, exist_ok=True)
 
-    with open(f"{outdir}/message.txt", "wb") as f:
-        f.write(part1)
+        # sendfile() needs a seekable regular file; only the mapped case has one.
+        in_fd = inp.fileno() if isinstance(raw, mmap.mmap) else None
+        write_view(f"{outdir}/message.txt", part1, in_fd, p1_start)
+        write_view(f"{outdir}/signature.asc", sig_body, in_fd, sig_start)
 
-    with open(f"{outdir}/signature.asc", "wb") as f:
-        f.write(sig_body)
+        # mmap refuses to close while memoryviews onto it are still alive.
+        part1.release()
+        sig_body.release()
+        mv.release()
+        if isinstance(raw, mmap.mmap):
+            raw.close()
 
     print("\n\033[92m✅ Extraction complete (raw-safe, no reformatting).\033[0m\n")
 